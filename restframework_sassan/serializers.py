@@ -1,14 +1,39 @@
-import time
+from datetime import date as _date
+from datetime import datetime as _dt
+from datetime import timezone as _std_tz
+from functools import lru_cache
+from operator import attrgetter
 
+from django.core.exceptions import FieldDoesNotExist
 from django.db.models import Model
 from django.db.models.fields.related import (ManyToManyField, ManyToManyRel,
                                              ManyToOneRel)
-from django.db.models.fields.related import ManyToManyField
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.serializers import ListSerializer
+from rest_framework.utils import model_meta
+
+_UTC = _std_tz.utc
+_EPOCH_ORDINAL = _date(1970, 1, 1).toordinal()
+_hms = attrgetter('hour', 'minute', 'second')
+_INTEGER_FIELD_TYPES = frozenset((
+    'AutoField',
+    'BigAutoField',
+    'SmallAutoField',
+    'IntegerField',
+    'BigIntegerField',
+    'SmallIntegerField',
+    'PositiveIntegerField',
+    'PositiveBigIntegerField',
+    'PositiveSmallIntegerField',
+))
+
+
+def _to_int(value):
+    return value if type(value) is int else int(value)
 
 
 class UnixEpochDateTimeField(serializers.DateTimeField):
@@ -19,31 +44,32 @@ class UnixEpochDateTimeField(serializers.DateTimeField):
             return None
 
     def to_internal_value(self, value):
-        return timezone.datetime.fromtimestamp(int(value), tz=timezone.utc)
+        return _dt.fromtimestamp(_to_int(value), tz=_UTC)
 
 
 class UnixEpochDateField(serializers.DateField):
     def to_representation(self, value):
         try:
-            return int(time.mktime(value.timetuple()))
+            if isinstance(value, _dt):
+                return int(value.timestamp())
+            return (value.toordinal() - _EPOCH_ORDINAL) * 86400
         except (AttributeError, TypeError):
             return None
 
     def to_internal_value(self, value):
-        return timezone.datetime.fromtimestamp(int(value), tz=timezone.utc).\
-            date()
+        return _dt.fromtimestamp(_to_int(value), tz=_UTC).date()
 
 
 class TimeField(serializers.TimeField):
     def to_representation(self, value):
         try:
-            return value.hour * 3600 + value.minute * 60 + value.second
+            h, m, s = _hms(value)
+            return h * 3600 + m * 60 + s
         except (AttributeError, TypeError):
             return None
 
     def to_internal_value(self, value):
-        return timezone.datetime.fromtimestamp(int(value), tz=timezone.utc).\
-            time()
+        return _dt.fromtimestamp(_to_int(value), tz=_UTC).time()
 
 
 class DurationField(serializers.DateTimeField):
@@ -60,46 +86,183 @@ class DurationField(serializers.DateTimeField):
 class BulkListSerializer(ListSerializer):
     update_lookup_field = 'id'
 
+    def to_internal_value(self, data):
+        if self.parent is not None and isinstance(data, list):
+            id_attr = getattr(self.child.Meta, 'update_lookup_field', 'id')
+            ids = [
+                item[id_attr]
+                for item in data
+                if isinstance(item, dict) and id_attr in item
+            ]
+            prefetched = {}
+            if ids:
+                prefetched = {
+                    str(getattr(obj, id_attr)): obj
+                    for obj in self.child.Meta.model.objects.filter(**{
+                        '{}__in'.format(id_attr): ids,
+                    })
+                }
+            self.child._prefetched = prefetched
+        return super().to_internal_value(data)
+
     def update(self, queryset, all_validated_data):
         id_attr = getattr(self.child.Meta, 'update_lookup_field', 'id')
 
+        model = self.child.Meta.model
+        if id_attr == 'pk':
+            id_field = model._meta.pk
+        else:
+            id_field = model._meta.get_field(id_attr)
+        if id_field.get_internal_type() in _INTEGER_FIELD_TYPES:
+            coerce = _to_int
+        else:
+            coerce = id_field.to_python
+
         all_validated_data_by_id = {
-            int(i.pop(id_attr)): i
+            coerce(i.pop(id_attr)): i
             for i in all_validated_data
         }
 
-        self.objects_to_update = queryset.filter(**{
-            '{}__in'.format(id_attr): all_validated_data_by_id.keys(),
-        })
+        self.objects_to_update = list(queryset.filter(**{
+            '{}__in'.format(id_attr): list(all_validated_data_by_id),
+        }))
 
-        if len(all_validated_data_by_id) != self.objects_to_update.count():
+        if len(all_validated_data_by_id) != len(self.objects_to_update):
             raise ValidationError(_('Could not find all objects to update.'))
 
+        get_id = attrgetter(id_attr)
+
+        if type(self.child).update is not BaseModelSerializer.update:
+            return [
+                self.child.update(obj, all_validated_data_by_id[get_id(obj)])
+                for obj in self.objects_to_update
+            ]
+
         updated_objects = []
+        update_fields = set()
+        many_to_many = []
+        dirty = {}
+
+        child_bulk_update = self.child.bulk_update
+        append = updated_objects.append
 
         for obj in self.objects_to_update:
-            obj_id = getattr(obj, id_attr)
-            obj_validated_data = all_validated_data_by_id.get(obj_id)
+            obj_validated_data = all_validated_data_by_id.get(get_id(obj))
+
+            obj_update_fields, obj_many_to_many = child_bulk_update(
+                obj,
+                obj_validated_data,
+                dirty,
+            )
+            update_fields.update(obj_update_fields)
+            many_to_many.append((obj, obj_many_to_many))
+            append(obj)
 
-            updated_objects.append(self.child.update(obj, obj_validated_data))
+        _save_dirty(dirty)
+
+        if update_fields:
+            self.child.Meta.model.objects.bulk_update(
+                updated_objects,
+                fields=list(update_fields),
+            )
+
+        for obj, obj_many_to_many in many_to_many:
+            for field, value in obj_many_to_many.items():
+                getattr(obj, field).set(value)
 
         return updated_objects
 
 
+def _bulk_save_fields(instance):
+    fields = []
+    for field in instance._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        if getattr(field, 'auto_now', False):
+            field.pre_save(instance, add=False)
+        fields.append(field.name)
+    return fields
+
+
+def _save_dirty(dirty):
+    for model, objs in dirty.items():
+        objs = list(objs.values())
+        fields = []
+        for obj in objs:
+            fields = _bulk_save_fields(obj)
+        if fields:
+            model.objects.bulk_update(objs, fields=fields)
+
+
+def _build_field_meta(model, fields):
+    m2m_field_names = frozenset(
+        name for name, field in fields.items() if isinstance(
+            field,
+            (serializers.ListSerializer, serializers.ManyRelatedField),
+        )
+    )
+    nested_field_names = frozenset(
+        name for name, field in fields.items() if isinstance(
+            field,
+            (serializers.Serializer, serializers.ListSerializer),
+        )
+    )
+    source_paths = {}
+    for name in nested_field_names:
+        head = fields[name].source.rpartition('.')[0]
+        source_paths[name] = tuple(head.split('.')) if head else ()
+    create_plan = (
+        tuple(name for name in fields if name not in m2m_field_names),
+        tuple(name for name in fields if name in m2m_field_names),
+    )
+    field_descriptors = {}
+    for name in nested_field_names:
+        related_model = model
+        try:
+            for part in source_paths[name]:
+                related_model = related_model._meta.get_field(
+                    part,
+                ).related_model
+            field_descriptors[name] = related_model._meta.get_field(name)
+        except (AttributeError, FieldDoesNotExist):
+            pass
+    return nested_field_names, source_paths, create_plan, field_descriptors
+
+
+def _has_static_fields(serializer_class):
+    return (
+        serializer_class.__init__ is BaseModelSerializer.__init__ and
+        serializer_class.get_fields is serializers.ModelSerializer.get_fields
+    )
+
+
+@lru_cache(maxsize=None)
+def _serializer_meta(serializer_class):
+    return _build_field_meta(
+        serializer_class.Meta.model,
+        serializer_class().fields,
+    )
+
+
 class BaseModelSerializer(serializers.ModelSerializer):
+    _fields_filtered = False
+
     class Meta:
         list_serializer_class = BulkListSerializer
 
     def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+
         super().__init__(*args, **kwargs)
 
-        fields = kwargs.pop('fields', None)
+        self._reusable_children = {}
+        self._prefetched = {}
+
         if fields:
-            fields = fields.split(',')
-            allowed = set(fields)
-            existing = set(self.fields.keys())
-            for field_name in existing - allowed:
+            allowed = frozenset(fields.split(','))
+            for field_name in [f for f in self.fields if f not in allowed]:
                 self.fields.pop(field_name)
+            self._fields_filtered = True
 
     def run_validators(self, value):
         to_validate = self._read_only_defaults()
@@ -107,30 +270,55 @@ class BaseModelSerializer(serializers.ModelSerializer):
             to_validate.update(value)
         super().run_validators(to_validate)
 
-    def to_internal_value(self, data):
-        id_attr = getattr(self.Meta, 'update_lookup_field', 'id')
-        if (
-            not self.parent or
-            isinstance(self.parent, serializers.ListSerializer) and
-            not self.parent.parent
-        ):
-            ret = super().to_internal_value(data)
-        elif id_attr in data:
-            instance = self.Meta.model.objects.get(**{id_attr: data[id_attr]})
+    @cached_property
+    def _parent_role(self):
+        parent = self.parent
+        is_top = (
+            not parent or
+            isinstance(parent, serializers.ListSerializer) and
+            not parent.parent
+        )
+        return is_top, isinstance(parent, BulkListSerializer)
+
+    def _reusable_child(self, instance, data, partial):
+        # Nested items are validated and saved one at a time, so a single
+        # standalone serializer per `partial` flag is reset and reused
+        # instead of rebuilding its fields for every item. This relies on
+        # DRF keeping its per-validation state in `_validated_data`,
+        # `_errors` and `_data`; the child must not be used after this
+        # serializer moves on to the next item.
+        serializer = self._reusable_children.get(partial)
+        if serializer is None:
             serializer = type(self)(
                 instance,
                 data=data,
-                partial=True,
+                partial=partial,
                 context=self.context,
             )
+            self._reusable_children[partial] = serializer
+        else:
+            serializer.instance = instance
+            serializer.initial_data = data
+            for attr in ('_validated_data', '_errors', '_data'):
+                serializer.__dict__.pop(attr, None)
+        return serializer
+
+    def to_internal_value(self, data):
+        id_attr = getattr(self.Meta, 'update_lookup_field', 'id')
+        is_top, is_bulk_child = self._parent_role
+        if is_top:
+            ret = super().to_internal_value(data)
+        elif id_attr in data:
+            instance = self._prefetched.get(str(data[id_attr]))
+            if instance is None:
+                instance = self.Meta.model.objects.get(
+                    **{id_attr: data[id_attr]}
+                )
+            serializer = self._reusable_child(instance, data, partial=True)
             serializer.is_valid(raise_exception=True)
             return serializer.save()
         else:
-            serializer = type(self)(
-                data=data,
-                partial=False,
-                context=self.context,
-            )
+            serializer = self._reusable_child(None, data, partial=False)
             serializer.is_valid(raise_exception=True)
             return serializer.save()
 
@@ -144,7 +332,7 @@ class BaseModelSerializer(serializers.ModelSerializer):
             request_method = None
 
         if all((
-            isinstance(self.parent, BulkListSerializer),
+            is_bulk_child,
             id_attr,
             request_method in ('PUT', 'PATCH'),
         )):
@@ -155,54 +343,127 @@ class BaseModelSerializer(serializers.ModelSerializer):
 
         return ret
 
+    @cached_property
+    def _field_meta(self):
+        serializer_class = type(self)
+        if self._fields_filtered or not _has_static_fields(serializer_class):
+            return _build_field_meta(self.Meta.model, self.fields)
+        return _serializer_meta(serializer_class)
+
+    @cached_property
+    def _nested_field_names(self):
+        return self._field_meta[0]
+
+    @cached_property
+    def _source_paths(self):
+        return self._field_meta[1]
+
+    @cached_property
+    def _create_plan(self):
+        return self._field_meta[2]
+
+    @cached_property
+    def _field_descriptors(self):
+        return self._field_meta[3]
+
     def create(self, validated_data):
-        data = {}
-        many_to_many_fields = {}
-        for field in self.fields:
-            if field in validated_data:
-                if isinstance(
-                    self.fields[field],
-                    (serializers.ListSerializer, serializers.ManyRelatedField),
-                ):
-                    many_to_many_fields[field] = validated_data[field]
-                else:
-                    data[field] = validated_data[field]
+        simple_field_names, m2m_field_names = self._create_plan
+        data = {
+            field: validated_data[field]
+            for field in simple_field_names
+            if field in validated_data
+        }
         instance = self.Meta.model.objects.create(**data)
-        for field in many_to_many_fields:
-            getattr(instance, field).set(many_to_many_fields[field])
-        instance.save()
+        for field in m2m_field_names:
+            if field in validated_data:
+                self._set_created_m2m(instance, field, validated_data[field])
         return instance
 
-    def update(self, instance, validated_data):
-        for field in self.fields:
+    @staticmethod
+    def _set_created_m2m(instance, field, values):
+        try:
+            model_field = instance._meta.get_field(field)
+        except FieldDoesNotExist:
+            model_field = None
+        if (
+            not isinstance(model_field, ManyToManyField) or
+            not model_field.remote_field.through._meta.auto_created or
+            model_field.remote_field.symmetrical
+        ):
+            getattr(instance, field).set(values)
+            return
+        through = model_field.remote_field.through
+        source_name = model_field.m2m_field_name()
+        target = through._meta.get_field(model_field.m2m_reverse_field_name())
+        target_attname = target.target_field.attname
+        through.objects.bulk_create(
+            [
+                through(**{
+                    source_name: instance,
+                    target.attname: getattr(value, target_attname, value),
+                })
+                for value in values
+            ],
+            ignore_conflicts=True,
+        )
+
+    def _update_nested(self, instance, validated_data, dirty):
+        nested_field_names = self._nested_field_names
+        for field in [f for f in validated_data if f in nested_field_names]:
+            v = validated_data
+            path = []
+            ins = instance
+            for part in self._source_paths[field]:
+                path.append((part, v))
+                v = v[part]
+                ins = getattr(ins, part)
+            field_obj = self._field_descriptors.get(field)
+            if field_obj is None:
+                field_obj = ins._meta.get_field(field)
             if isinstance(
-                self.fields[field],
-                (serializers.Serializer, serializers.ListSerializer),
+                field_obj,
+                (ManyToManyField, ManyToManyRel, ManyToOneRel),
             ):
-                v = validated_data
-                path = []
-                ins = instance
-                source = self.fields[field].source
-                if field in v:
-                    while '.' in source:
-                        path.append((source.partition('.')[0], v))
-                        v = v[source.partition('.')[0]]
-                        ins = getattr(ins, source.partition('.')[0])
-                        source = source.partition('.')[2]
-                    if isinstance(
-                        ins._meta.get_field(field),
-                        (ManyToManyField, ManyToManyRel, ManyToOneRel),
-                    ):
-                        getattr(ins, field).set(v[field])
-                    else:
-                        setattr(ins, field, v[field])
-                    v.pop(field)
-                    ins.save()
-                    for field, data in reversed(path):
-                        if len(data[field]) == 0:
-                            del data[field]
+                getattr(ins, field).set(v[field])
+            else:
+                setattr(ins, field, v[field])
+                if ins is not instance:
+                    dirty.setdefault(type(ins), {})[id(ins)] = ins
+            v.pop(field)
+            for part, data in reversed(path):
+                if len(data[part]) == 0:
+                    del data[part]
 
+    def update(self, instance, validated_data):
+        dirty = {}
+        self._update_nested(instance, validated_data, dirty)
+        _save_dirty(dirty)
         return super(BaseModelSerializer, self).update(
             instance,
             validated_data,
         )
+
+    def bulk_update(self, instance, validated_data, dirty=None):
+        """
+        Apply validated_data to instance in memory for a batched write.
+
+        Returns the fields to pass to Model.objects.bulk_update() and the
+        to-many values to .set() afterwards. Model.save() overrides and
+        pre_save/post_save signals are bypassed; auto_now fields are still
+        refreshed. Related objects changed through dotted sources are
+        collected in dirty, or written right away when it is not given.
+        """
+        flush = dirty is None
+        if flush:
+            dirty = {}
+        self._update_nested(instance, validated_data, dirty)
+        if flush:
+            _save_dirty(dirty)
+        info = model_meta.get_field_info(instance)
+        many_to_many = {}
+        for attr, value in validated_data.items():
+            if attr in info.relations and info.relations[attr].to_many:
+                many_to_many[attr] = value
+            else:
+                setattr(instance, attr, value)
+        return _bulk_save_fields(instance), many_to_many